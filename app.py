@@ -1,7 +1,18 @@
 # app.py
+import os
+import tempfile
+
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+import plotly.io as pio
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import requests
+
+# Serialize figures with orjson (much faster than the default json encoder)
+pio.json.config.default_engine = "orjson"
 
 # -----------------------------------------------------------------------------
 # Page config
@@ -16,20 +27,123 @@ st.set_page_config(
 # -----------------------------------------------------------------------------
 GITHUB_RAW_URL = "https://raw.githubusercontent.com/azd169/timber_prices/main/ms_stumpage.csv"
 
-@st.cache_data
-def load_stumpage():
+# Local Parquet snapshot of the typed frame (skips CSV parsing on cold starts).
+# Bump SNAPSHOT_VERSION whenever the dtypes/sorting written below change, so a
+# snapshot from older code isn't reused just because the upstream ETag matches
+SNAPSHOT_VERSION = 4
+PARQUET_PATH = os.path.join(tempfile.gettempdir(), f"stumpage.v{SNAPSHOT_VERSION}.parquet")
+# ETag of the CSV the snapshot was built from (for conditional GETs)
+ETAG_PATH = PARQUET_PATH + ".etag"
+
+# Order of types for plotting (to mimic your factor levels)
+type_order = [
+    "Pine Sawtimber",
+    "Mixed Hardwood Sawtimber",
+    "Pine Chip-n-Saw",
+    "Pine Pulpwood",
+    "Hardwood Pulpwood"
+]
+quarter_order = ["Q1", "Q2", "Q3", "Q4"]
+
+# Color mapping to match your ggplot scale_color_manual, indexed by Type code
+# (i.e. aligned with type_order)
+COLOR_BY_CODE = ("#D55E00", "#009E73", "#E69F00", "#0072B2", "#CC79A7")
+
+# Symbol mapping (Plotly marker symbols), indexed by Type code
+SYMBOL_BY_CODE = ("circle", "square", "diamond", "triangle-up", "triangle-down")
+
+def download_stumpage(etag=None):
+    headers = {}
+    # Optional: if you add a token (for private repos) via Streamlit secrets
+    token = st.secrets.get("GITHUB_TOKEN", None)
+    if token:
+        headers["Authorization"] = f"token {token}"
+    if etag:
+        headers["If-None-Match"] = etag
+
+    resp = requests.get(GITHUB_RAW_URL, headers=headers, timeout=10)
+
+    # 304 Not Modified: the local snapshot is still current
+    if resp.status_code == 304:
+        return None, etag
+    resp.raise_for_status()  # will raise HTTPError if not 200
+
+    # Parse the raw bytes directly with Arrow (no text decode / StringIO copy)
+    df = pa_csv.read_csv(pa.BufferReader(resp.content)).to_pandas()
+    return df, resp.headers.get("ETag")
+
+def _atomic_write(target, write):
+    # Write to a temp file next to target, then rename it into place, so a
+    # crash mid-write never leaves a truncated file at target
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+    os.close(fd)
     try:
-        headers = {}
-        # Optional: if you add a token (for private repos) via Streamlit secrets
-        token = st.secrets.get("GITHUB_TOKEN", None)
-        if token:
-            headers["Authorization"] = f"token {token}"
+        write(tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@st.cache_resource
+def _fetch_parquet_path():
+    # Revalidate an existing snapshot instead of downloading it again
+    cached_etag = None
+    if os.path.exists(PARQUET_PATH) and os.path.exists(ETAG_PATH):
+        with open(ETAG_PATH) as f:
+            cached_etag = f.read().strip() or None
 
-        resp = requests.get(GITHUB_RAW_URL, headers=headers, timeout=10)
-        resp.raise_for_status()  # will raise HTTPError if not 200
+    try:
+        df, etag = download_stumpage(cached_etag)
+    except (requests.ConnectionError, requests.Timeout):
+        # Offline or GitHub unreachable: keep serving the last snapshot if any.
+        # HTTP status errors (bad token, moved file) still surface as errors
+        if os.path.exists(PARQUET_PATH):
+            st.warning("⚠️ Could not reach GitHub; showing cached stumpage data.")
+            return PARQUET_PATH
+        raise
+    if df is None:
+        return PARQUET_PATH
+
+    # Make sure Year is numeric just in case (rows without a year can never
+    # fall inside the year filter, so they are dropped here)
+    df["Year"] = pd.to_numeric(df["Year"], errors="coerce")
+    df = df.dropna(subset=["Year"]).astype({"Year": "int16"})
+    df["Type"] = pd.Categorical(df["Type"], categories=type_order, ordered=True)
+    df["Quarter"] = pd.Categorical(df["Quarter"], categories=quarter_order, ordered=True)
+
+    # Prices have two decimals, so float32 is plenty and halves their size
+    for c in ("Minimum", "Average", "Maximum"):
+        df[c] = pd.to_numeric(df[c], errors="coerce").astype("float32")
+
+    # Time is treated as an ordered categorical on the x-axis
+    time_str = df["Time"].astype(str)
+    df["Time"] = pd.Categorical(time_str, categories=sorted(time_str.unique()), ordered=True)
+
+    # Sorted by year so the year filter can binary-search a slice; the index
+    # keeps each row's position in the source CSV (used for downloads)
+    df = df.sort_values(["Year", "Quarter"], kind="stable")
+
+    # Drop the old ETag first so it can never be paired with a new snapshot
+    if os.path.exists(ETAG_PATH):
+        os.remove(ETAG_PATH)
+
+    # Categorical dtype round-trips through Parquet dictionary encoding
+    _atomic_write(PARQUET_PATH, lambda path: df.to_parquet(path, compression="snappy", index=True))
+
+    if etag:
+        def write_etag(path):
+            with open(path, "w") as f:
+                f.write(etag)
+
+        _atomic_write(ETAG_PATH, write_etag)
+
+    return PARQUET_PATH
 
-        # Read CSV from the text content
-        return pd.read_csv(io.StringIO(resp.text))
+@st.cache_data
+def load_stumpage():
+    try:
+        return pd.read_parquet(_fetch_parquet_path(), engine="pyarrow")
     except Exception as e:
         st.error(
             "❌ Could not download stumpage data from GitHub. "
@@ -41,18 +155,8 @@ def load_stumpage():
 
 stumpage = load_stumpage()
 
-# Make sure Year is numeric just in case
-stumpage["Year"] = pd.to_numeric(stumpage["Year"], errors="coerce")
-
-# Order of types for plotting (to mimic your factor levels)
-type_order = [
-    "Pine Sawtimber",
-    "Mixed Hardwood Sawtimber",
-    "Pine Chip-n-Saw",
-    "Pine Pulpwood",
-    "Hardwood Pulpwood"
-]
-stumpage["Type"] = pd.Categorical(stumpage["Type"], categories=type_order, ordered=True)
+# Sorted year column for np.searchsorted in the year filter
+years = stumpage["Year"].to_numpy(np.int16)
 
 # -----------------------------------------------------------------------------
 # Optional: Inject CSS (rough equivalent of your Shiny CSS + dark mode hints)
@@ -122,49 +226,57 @@ min_year = int(stumpage["Year"].min())
 max_year = int(stumpage["Year"].max())
 
 all_types = [t for t in type_order if t in stumpage["Type"].unique()]
-all_quarters = ["Q1", "Q2", "Q3", "Q4"]
+all_quarters = quarter_order
+
+# Filter widgets are keyed so Clear All can reset them; defaults are set here
+# rather than via default=/value= so the reset doesn't clash with them
+st.session_state.setdefault("selected_types", [])
+st.session_state.setdefault("selected_quarters", [])
+st.session_state.setdefault("year_range", (min_year, max_year))
+
+def clear_filters():
+    st.session_state["selected_types"] = []
+    st.session_state["selected_quarters"] = []
+    st.session_state["year_range"] = (min_year, max_year)
 
 with left_col:
-    # Price selector
-    price_selector = st.radio(
-        "Select Price:",
-        options=["Minimum", "Average", "Maximum"],
-        index=1  # default "Average"
-    )
+    # Filters live in a form so the filter + plot pipeline only reruns on Apply
+    with st.form("filters"):
+        # Price selector
+        price_selector = st.radio(
+            "Select Price:",
+            options=["Minimum", "Average", "Maximum"],
+            index=1  # default "Average"
+        )
 
-    # Type selector (equivalent to checkboxGroupInput)
-    selected_types = st.multiselect(
-        "Select Type(s):",
-        options=all_types,
-        default=[]
-    )
+        # Type selector (equivalent to checkboxGroupInput)
+        selected_types = st.multiselect(
+            "Select Type(s):",
+            options=all_types,
+            key="selected_types"
+        )
 
-    # Quarter selector
-    selected_quarters = st.multiselect(
-        "Select Quarter(s):",
-        options=all_quarters,
-        default=[]
-    )
+        # Quarter selector
+        selected_quarters = st.multiselect(
+            "Select Quarter(s):",
+            options=all_quarters,
+            key="selected_quarters"
+        )
 
-    # Year slider
-    year_range = st.slider(
-        "Select Year Range:",
-        min_value=min_year,
-        max_value=max_year,
-        value=(min_year, max_year),
-        step=1
-    )
+        # Year slider
+        year_range = st.slider(
+            "Select Year Range:",
+            min_value=min_year,
+            max_value=max_year,
+            step=1,
+            key="year_range"
+        )
 
-    # Clear all button → reset selections using session state
-    if st.button("Clear All"):
-        st.session_state["selected_types"] = []
-        st.session_state["selected_quarters"] = []
-        st.session_state["year_range"] = (min_year, max_year)
+        if st.form_submit_button("Apply"):
+            st.session_state["filters_applied"] = True
 
-    # Re-bind after potential reset
-    selected_types = st.session_state.get("selected_types", selected_types)
-    selected_quarters = st.session_state.get("selected_quarters", selected_quarters)
-    year_range = st.session_state.get("year_range", year_range)
+    # Clear all button → reset the form widgets before the next rerun
+    st.button("Clear All", on_click=clear_filters)
 
 with right_col:
     st.markdown(
@@ -196,33 +308,39 @@ st.write("---")
 # -----------------------------------------------------------------------------
 # Filter data (equivalent to filtered_data() reactive)
 # -----------------------------------------------------------------------------
-def get_filtered_data():
-    # Require at least one type, year range, and quarter
-    if not selected_types or not selected_quarters or year_range is None:
-        return None
-
-    yr_min, yr_max = year_range
+# Bounded: one filtered frame is kept per distinct selection
+@st.cache_data(max_entries=64)
+def _filter(types: tuple, quarters: tuple, yr_min: int, yr_max: int) -> pd.DataFrame:
+    # Year range is a contiguous slice of the year-sorted frame
+    lo, hi = np.searchsorted(years, [yr_min, yr_max + 1])
+    window = stumpage.iloc[lo:hi]
 
-    data = stumpage[
-        (stumpage["Type"].isin(selected_types)) &
-        (stumpage["Year"] >= yr_min) &
-        (stumpage["Year"] <= yr_max) &
-        (stumpage["Quarter"].isin(selected_quarters))
-    ].copy()
+    # Compare small integer category codes instead of strings
+    type_codes = window["Type"].cat.codes.to_numpy()
+    q_codes = window["Quarter"].cat.codes.to_numpy()
 
-    # Ensure Time is treated as an ordered categorical on the x-axis
-    if "Time" in data.columns:
-        unique_time = sorted(data["Time"].unique())
-        data["Time"] = pd.Categorical(data["Time"], categories=unique_time, ordered=True)
+    wanted_type_codes = stumpage["Type"].cat.categories.get_indexer(list(types))
+    wanted_q_codes = stumpage["Quarter"].cat.categories.get_indexer(list(quarters))
 
-    return data
+    mask = np.isin(type_codes, wanted_type_codes) & np.isin(q_codes, wanted_q_codes)
+    # Read-only slice; nothing downstream assigns back into it
+    return window[mask]
 
-data = get_filtered_data()
+def get_filtered_data():
+    return _filter(*selection_key())
+
+def selection_key():
+    # Sorted tuples so logically-equal selections share a cache entry
+    return (
+        tuple(sorted(selected_types)),
+        tuple(sorted(selected_quarters)),
+        *year_range
+    )
 
 # -----------------------------------------------------------------------------
-# Plot or message
+# Empty-state message and footer
 # -----------------------------------------------------------------------------
-if data is None or data.shape[0] == 0:
+def render_empty_message():
     st.markdown(
         "<h3 style='color:red; text-align:center; margin-top:80px;'>"
         "No types, years, or quarters selected, or no data available. "
@@ -230,112 +348,141 @@ if data is None or data.shape[0] == 0:
         "</h3>",
         unsafe_allow_html=True
     )
+
+def render_footer():
+    st.write("")
+    st.write("---")
+
+    st.markdown(
+        """
+        <div style="text-align: center; margin-top: 40px; font-size: 20px;">
+        For further assistance contact
+        <a href="mailto:ads992@msstate.edu">Andrea De&nbsp;Stefano</a>.
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
+
+# Require at least one type and quarter (and an applied form) before touching
+# stumpage at all; the footer is still rendered before stopping
+if not st.session_state.get("filters_applied") or not selected_types or not selected_quarters:
+    render_empty_message()
+    render_footer()
+    st.stop()
+
+data = get_filtered_data()
+
+# -----------------------------------------------------------------------------
+# Build figure (cached per selection + price column; treat as read-only)
+# -----------------------------------------------------------------------------
+# Bounded: every distinct selection would otherwise keep a Figure alive
+@st.cache_resource(max_entries=32)
+def build_fig(types, quarters, yr_min, yr_max, price_column_name):
+    data = _filter(types, quarters, yr_min, yr_max)
+
+    fig = go.Figure()
+
+    # Pivot once into plain NumPy arrays per Type code: (time labels, price).
+    # One groupby pass over the Type codes (only types present are yielded);
+    # float32 NumPy arrays are base64-encoded by plotly instead of listed
+    data = data.sort_values("Time")
+    soa = {
+        code: (g["Time"].to_numpy(str), g[price_column_name].to_numpy(np.float32))
+        for code, g in data.groupby(data["Type"].cat.codes)
+    }
+
+    # Plot each type separately (lines + markers), added to the figure in one batch
+    traces = []
+    for code, (x, y) in soa.items():
+        t = type_order[code]
+
+        traces.append(
+            go.Scattergl(
+                x=x,
+                y=y,
+                mode="lines+markers",
+                name=t,
+                marker=dict(
+                    size=9,
+                    symbol=SYMBOL_BY_CODE[code],
+                    color=COLOR_BY_CODE[code],
+                ),
+                line=dict(width=2, color=COLOR_BY_CODE[code]),
+                hovertemplate=(
+                    f"Type: {t}<br>"
+                    "Time: %{x}<br>"
+                    "Price ($/ton): %{y:.2f}<extra></extra>"
+                ),
+            )
+        )
+    fig.add_traces(traces)
+
+    # X ticks: show every 4th selected time like your ggplot code (a categorical
+    # axis drops tick values that aren't plotted, so use the selected times only)
+    selected_times = data["Time"].cat.remove_unused_categories().cat.categories
+    tickvals = list(selected_times[::4])
+
+    fig.update_layout(
+        xaxis=dict(
+            title="",
+            showgrid=True,
+            tickfont=dict(color="black"),
+            gridcolor="lightgray",
+            zerolinecolor="black",
+            tickvals=tickvals,
+            tickangle=45
+        ),
+        yaxis=dict(
+            title="Price ($/ton)",
+            showgrid=True,
+            tickfont=dict(color="black"),
+            gridcolor="lightgray",
+            zerolinecolor="black",
+            tickmode="linear",
+            dtick=5  # step of 5 as in scale_y_continuous(seq(0, 100, by = 5))
+        ),
+        legend=dict(
+            orientation="h",
+            yanchor="top",
+            y=-0.15,
+            xanchor="center",
+            x=0.5
+        ),
+        margin=dict(l=50, r=50, t=50, b=120),
+        plot_bgcolor="white",
+        paper_bgcolor="white",
+        xaxis_title_font=dict(color="black", size=16),
+        yaxis_title_font=dict(color="black", size=16),
+        font=dict(color="black")
+    )
+
+    return fig
+
+# -----------------------------------------------------------------------------
+# Plot or message
+# -----------------------------------------------------------------------------
+if data.shape[0] == 0:
+    render_empty_message()
 else:
     # Determine which price column to use
     price_column_name = price_selector  # "Minimum" / "Average" / "Maximum"
     if price_column_name not in data.columns:
         st.error(f"Column '{price_column_name}' not found in data.")
     else:
-        y_vals = data[price_column_name]
-
-        # Color mapping to match your ggplot scale_color_manual
-        color_map = {
-            "Pine Sawtimber": "#D55E00",
-            "Mixed Hardwood Sawtimber": "#009E73",
-            "Pine Chip-n-Saw": "#E69F00",
-            "Pine Pulpwood": "#0072B2",
-            "Hardwood Pulpwood": "#CC79A7",
-        }
-
-        # Symbol mapping (Plotly marker symbols)
-        symbol_map = {
-            "Pine Sawtimber": "circle",
-            "Mixed Hardwood Sawtimber": "square",
-            "Pine Chip-n-Saw": "diamond",
-            "Pine Pulpwood": "triangle-up",
-            "Hardwood Pulpwood": "triangle-down",
-        }
-
-        fig = go.Figure()
-
-        # Plot each type separately (lines + markers)
-        for t in data["Type"].cat.categories:
-            if t not in data["Type"].values:
-                continue
-
-            df_t = data[data["Type"] == t].sort_values("Time")
-
-            fig.add_trace(
-                go.Scatter(
-                    x=df_t["Time"],
-                    y=df_t[price_column_name],
-                    mode="lines+markers",
-                    name=t,
-                    marker=dict(
-                        size=9,
-                        symbol=symbol_map.get(t, "circle"),
-                    ),
-                    line=dict(width=2),
-                    hovertemplate=(
-                        "Type: %{customdata[0]}<br>"
-                        "Time: %{x}<br>"
-                        "Price ($/ton): %{y:.2f}<extra></extra>"
-                    ),
-                    customdata=df_t[["Type"]],
-                )
-            )
-
-        # X ticks: show every 4th value like your ggplot code
-        if "Time" in data.columns:
-            cats = list(data["Time"].cat.categories)
-            if len(cats) > 0:
-                tickvals = cats[::4]
-            else:
-                tickvals = []
-        else:
-            tickvals = None
-
-        fig.update_layout(
-            xaxis=dict(
-                title="",
-                showgrid=True,
-                tickfont=dict(color="black"),
-                gridcolor="lightgray",
-                zerolinecolor="black",
-                tickvals=tickvals,
-                tickangle=45
-            ),
-            yaxis=dict(
-                title="Price ($/ton)",
-                showgrid=True,
-                tickfont=dict(color="black"),
-                gridcolor="lightgray",
-                zerolinecolor="black",
-                tickmode="linear",
-                dtick=5  # step of 5 as in scale_y_continuous(seq(0, 100, by = 5))
-            ),
-            legend=dict(
-                orientation="h",
-                yanchor="top",
-                y=-0.15,
-                xanchor="center",
-                x=0.5
-            ),
-            margin=dict(l=50, r=50, t=50, b=120),
-            plot_bgcolor="white",
-            paper_bgcolor="white",
-            xaxis_title_font=dict(color="black", size=16),
-            yaxis_title_font=dict(color="black", size=16),
-            font=dict(color="black")
-        )
-
+        fig = build_fig(*selection_key(), price_column_name)
         st.plotly_chart(fig, use_container_width=True)
 
 # -----------------------------------------------------------------------------
 # Download filtered data
 # -----------------------------------------------------------------------------
-if data is not None and data.shape[0] > 0:
-    csv_bytes = data.to_csv(index=False).encode("utf-8")
+@st.cache_data(max_entries=32)
+def _to_csv_bytes(key, _df):
+    # Cached on the selection key only (leading underscore: _df is not hashed).
+    # Rows go back to source CSV order, as in the original download
+    return _df.sort_index().to_csv(index=False).encode("utf-8")
+
+if data.shape[0] > 0:
+    csv_bytes = _to_csv_bytes(selection_key(), data)
     st.download_button(
         label="Download Data as CSV",
         data=csv_bytes,
@@ -343,19 +490,7 @@ if data is not None and data.shape[0] > 0:
         mime="text/csv"
     )
 
-st.write("")
-st.write("---")
-
 # -----------------------------------------------------------------------------
 # Footer
 # -----------------------------------------------------------------------------
-st.markdown(
-    """
-    <div style="text-align: center; margin-top: 40px; font-size: 20px;">
-    For further assistance contact
-    <a href="mailto:ads992@msstate.edu">Andrea De&nbsp;Stefano</a>.
-    </div>
-    """,
-    unsafe_allow_html=True
-
-)
+render_footer()